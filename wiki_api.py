@@ -1,43 +1,50 @@
 import requests
-from bs4 import BeautifulSoup
+from selectolax.parser import HTMLParser
 import os
-import gzip
-import json
+try:
+    from isal import igzip as gzip
+except ImportError:
+    import gzip
+import msgspec
 import base64
+import io
 import pyarrow as pa
+import pyarrow.compute as pc
 import pyarrow.parquet as pq
 import regex as re
 from tqdm import tqdm
-import random
-import string
 import shutil
+import tempfile
 import time
+from collections import deque
+from operator import attrgetter
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
 def extract_links(url, prefix, ends_with=None, return_first=False):
     response = requests.get(url)
-    soup = BeautifulSoup(response.content, 'html.parser')
-    links = soup.find_all('a', href=True)
-    
+    tree = HTMLParser(response.content)
+
+    link_re = re.compile('^' + re.escape(prefix) + r'-(\d+)(?:-|$)')
     matching_links = []
-    for link in links:
-        href = link['href']
-        if href.startswith(prefix):
-            if ends_with and not href.endswith(ends_with):
-                continue
-            parts = href.split('-')
-            if len(parts) > 1 and parts[1].isdigit():
-                numerical_value = parts[1]
-                full_link = url + href
-                matching_links.append((numerical_value, full_link))
-                if return_first:
-                    return matching_links
-    
+    for link in tree.css('a[href]'):
+        href = link.attributes['href']
+        if not href:
+            continue
+        if ends_with and not href.endswith(ends_with):
+            continue
+        match = link_re.match(href)
+        if match:
+            matching_links.append((match.group(1), url + href))
+            if return_first:
+                return matching_links
+
     return matching_links
 
-def download_file(link, directory='.'):
+DOWNLOAD_CHUNK_BYTES = 1 << 20
+DOWNLOAD_PARTS = 8
+
+def download_stream(link, filename):
     response = requests.get(link, stream=True)
-    filename = os.path.join(directory, link.split('/')[-1])
-    
     total_size = int(response.headers.get('content-length', 0))
     with open(filename, 'wb') as file, tqdm(
         desc=filename,
@@ -46,52 +53,206 @@ def download_file(link, directory='.'):
         unit_scale=True,
         unit_divisor=1024,
     ) as bar:
-        for chunk in response.iter_content(chunk_size=8192):
+        if total_size:
+            file.truncate(total_size)
+            if hasattr(os, 'posix_fadvise'):
+                os.posix_fadvise(file.fileno(), 0, total_size, os.POSIX_FADV_SEQUENTIAL)
+        for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_BYTES):
             if chunk:
                 file.write(chunk)
                 bar.update(len(chunk))
-    
+
+def download_range(link, fd, start, end, bar):
+    with requests.Session() as session:
+        response = session.get(link, headers={'Range': f'bytes={start}-{end}'}, stream=True)
+        offset = start
+        for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_BYTES):
+            if chunk:
+                os.pwrite(fd, chunk, offset)
+                offset += len(chunk)
+                bar.update(len(chunk))
+
+def download_file(link, directory='.'):
+    filename = os.path.join(directory, link.split('/')[-1])
+
+    head = requests.head(link, allow_redirects=True)
+    total_size = int(head.headers.get('content-length', 0))
+    accepts_ranges = head.headers.get('accept-ranges', '').lower() == 'bytes'
+
+    if not total_size or not accepts_ranges:
+        download_stream(link, filename)
+        print(f"Downloaded: {filename}")
+        return filename
+
+    part_size = -(-total_size // DOWNLOAD_PARTS)
+    with open(filename, 'wb') as file, tqdm(
+        desc=filename,
+        total=total_size,
+        unit='B',
+        unit_scale=True,
+        unit_divisor=1024,
+    ) as bar:
+        file.truncate(total_size)
+        with ThreadPoolExecutor(max_workers=DOWNLOAD_PARTS) as executor:
+            futures = []
+            for start in range(0, total_size, part_size):
+                end = min(start + part_size, total_size) - 1
+                futures.append(executor.submit(download_range, link, file.fileno(), start, end, bar))
+            for future in futures:
+                future.result()
+
     print(f"Downloaded: {filename}")
     return filename
 
+_TITLE_TRANS = str.maketrans({' ': '_'})
+
 def format_title(title):
     if title:
-        return title.replace(' ', '_')
+        return title.translate(_TITLE_TRANS)
     return None
 
+CLEAN_PATTERN = r'[^\p{L}\s]+'
+_CLEAN_RE = re.compile(CLEAN_PATTERN)
+_ASCII_CLEAN_TABLE = str.maketrans('', '', ''.join(
+    chr(c) for c in range(128) if not chr(c).isalpha() and not chr(c).isspace()
+))
+
 def clean_text(text):
     if text:
-        return re.sub(r'[^\p{L}\s]', '', text, flags=re.UNICODE)
+        if text.isascii():
+            return text.translate(_ASCII_CLEAN_TABLE)
+        return _CLEAN_RE.sub('', text)
     return None
 
+def clean_text_column(array):
+    return pc.replace_substring_regex(array, pattern=CLEAN_PATTERN, replacement='')
+
+class Entry(msgspec.Struct):
+    wiki: str | None = None
+    language: str | None = None
+    title: str | None = None
+    full_text: str | None = None
+    opening_text: str | None = None
+    popularity_score: float | None = None
+
+_ENTRY_DECODER = msgspec.json.Decoder(Entry)
+
+LINES_PER_CHUNK = 4096
+
+COLUMN_NAMES = ('URL', 'Wiki', 'Language', 'Title', 'Abstract', 'Full Text', 'Popularity Score')
+
+def make_line_processor(extract_option, language_code):
+    # Specialize the per-line work once: the run-constant branches
+    # (which text fields to read) are resolved here instead of per row.
+    decode = _ENTRY_DECODER.decode
+    read_full_text = attrgetter('full_text') if extract_option in ['full_text', 'both'] else (lambda entry: None)
+    read_abstract = attrgetter('opening_text') if extract_option in ['abstract', 'both'] else (lambda entry: None)
+    url_prefix = f"https://{language_code}.wikipedia.org/wiki/"
+
+    def process_lines(lines):
+        urls = []
+        wikis = []
+        languages = []
+        titles = []
+        abstracts = []
+        full_texts = []
+        popularity_scores = []
+        for line in lines:
+            entry = decode(line)
+
+            wiki = entry.wiki
+            language = entry.language
+            title = entry.title
+            full_text = read_full_text(entry)
+            abstract = read_abstract(entry)
+
+            if wiki and language and title and (full_text or abstract):
+                urls.append(url_prefix + format_title(title))
+                wikis.append(wiki)
+                languages.append(language)
+                titles.append(title)
+                abstracts.append(abstract)
+                full_texts.append(full_text)
+                popularity_scores.append(entry.popularity_score)
+        return urls, wikis, languages, titles, abstracts, full_texts, popularity_scores
+
+    return process_lines
+
+_LINE_PROCESSOR = None
+
+def init_line_processor(extract_option, language_code):
+    global _LINE_PROCESSOR
+    _LINE_PROCESSOR = make_line_processor(extract_option, language_code)
+
+def process_lines(lines):
+    return _LINE_PROCESSOR(lines)
+
 def validate_output_file(output_file_path):
     if not output_file_path.endswith(".parquet"):
         raise ValueError("Output file must have a .parquet extension.")
 
+READ_BUFFER_BYTES = 1 << 20
+
 def open_file(file_path):
     if file_path.endswith('.json.gz'):
-        return gzip.open(file_path, 'rt', encoding='utf-8')
+        return io.BufferedReader(gzip.open(file_path, 'rb'), buffer_size=READ_BUFFER_BYTES)
     elif file_path.endswith('.json'):
-        return open(file_path, 'r')
+        return open(file_path, 'rb', buffering=READ_BUFFER_BYTES)
     else:
         raise ValueError("Unsupported file format. Only .json and .json.gz are allowed.")
 
-def save_checkpoint(data, checkpoint_num, checkpoint_folder, column_name):
-    if not os.path.exists(checkpoint_folder):
-        os.makedirs(checkpoint_folder)
-    
+WRITE_BATCH_ROWS = 8192
+
+PARQUET_WRITE_OPTIONS = {
+    'compression': 'zstd',
+    'compression_level': 3,
+    'use_dictionary': ['Wiki', 'Language', 'URL'],
+    'write_statistics': True
+}
+
+def build_schema(text_columns):
+    fields = [
+        ('URL', pa.string()),
+        ('Wiki', pa.dictionary(pa.int32(), pa.string())),
+        ('Language', pa.dictionary(pa.int32(), pa.string())),
+        ('Title', pa.string())
+    ]
+    fields.extend((name, pa.string()) for name in text_columns)
+    fields.extend([
+        ('Version Control', pa.string()),
+        ('Popularity Score', pa.float64())
+    ])
+    return pa.schema(fields)
+
+def save_checkpoint(batches, checkpoint_num, checkpoint_folder):
     checkpoint_path = os.path.join(checkpoint_folder, f"checkpoint_{checkpoint_num}.parquet")
-    table = pa.Table.from_pydict({
-        'URL': [d['URL'] for d in data],
-        'Wiki': [d['Wiki'] for d in data],
-        'Language': [d['Language'] for d in data],
-        'Title': [d['Title'] for d in data],
-        column_name: [d[column_name] for d in data],
-        'Version Control': [d['Version Control'] for d in data],
-        'Popularity Score': [d['Popularity Score'] for d in data]
-    })
-    pq.write_table(table, checkpoint_path)
-    print(f"Checkpoint saved at {checkpoint_path}")
+    pq.write_table(pa.Table.from_batches(batches), checkpoint_path, row_group_size=WRITE_BATCH_ROWS, **PARQUET_WRITE_OPTIONS)
+
+def build_version_control(base_value, start_index, count):
+    encode = base64.b64encode
+    return [
+        encode(f"{base_value}{i}".encode('utf-8')).decode('utf-8')
+        for i in range(start_index, start_index + count)
+    ]
+
+def flush_batch(columns, count, writer, schema, checkpoint_num, checkpoint_folder, base_value, start_index, clean_columns=()):
+    version_control = build_version_control(base_value, start_index, count)
+    batches = []
+    for start in range(0, count, WRITE_BATCH_ROWS):
+        stop = start + WRITE_BATCH_ROWS
+        arrays = []
+        for field in schema:
+            if field.name == 'Version Control':
+                array = pa.array(version_control[start:stop], type=field.type)
+            else:
+                array = pa.array(columns[field.name][start:stop], type=field.type)
+            if field.name in clean_columns:
+                array = clean_text_column(array)
+            arrays.append(array)
+        batch = pa.RecordBatch.from_arrays(arrays, schema=schema)
+        writer.write_batch(batch)
+        batches.append(batch)
+    save_checkpoint(batches, checkpoint_num, checkpoint_folder)
 
 def count_rows_in_parquet(file_path):
     # Start timing
@@ -140,115 +301,82 @@ def main():
     extract_option = input("Do you want to extract abstract, full text, or both? (abstract/full_text/both): ").lower()
     clean_text_flag = input("Do you want to enable text cleaning? (yes/no): ").strip().lower()
     checkpoint_interval = int(input("Enter the checkpoint interval (number of rows per checkpoint): ").strip())
-    checkpoint_folder = ''.join(random.choices(string.ascii_letters + string.digits, k=10))
+    checkpoint_folder = tempfile.mkdtemp(prefix='wiki_ckpt_')
+
+    text_columns = []
+    if extract_option in ['abstract', 'both']:
+        text_columns.append('Abstract')
+    if extract_option in ['full_text', 'both']:
+        text_columns.append('Full Text')
+    clean_columns = text_columns if clean_text_flag == 'yes' else []
+
+    # One output file; with 'both' the Abstract and Full Text columns share it
+    output_suffix = 'abstract_full_text' if extract_option == 'both' else extract_option
+    output_file = f"{user_prefix}_{output_suffix}.parquet"
 
-    # Output file names
-    abstract_output_file = f"{user_prefix}_abstract.parquet"
-    full_text_output_file = f"{user_prefix}_full_text.parquet"
+    schema = build_schema(text_columns)
+    writer = pq.ParquetWriter(output_file, schema, **PARQUET_WRITE_OPTIONS)
 
-    data_abstract = []
-    data_full_text = []
-    checkpoint_data_abstract = []
-    checkpoint_data_full_text = []
+    checkpoint_columns = {name: [] for name in COLUMN_NAMES}
     extract_all = True
     limit = 50
     processed_count = 0
+    flushed_count = 0
     checkpoint_num = 0
 
-    with open_file(downloaded_file) as file:
-        for i, line in enumerate(file):
+    max_workers = os.cpu_count()
+
+    progress = tqdm(desc="Processing entries", unit='row', mininterval=0.5)
+
+    with open_file(downloaded_file) as file, ProcessPoolExecutor(
+        max_workers=max_workers,
+        initializer=init_line_processor,
+        initargs=(extract_option, language_code)
+    ) as executor:
+        def flush_checkpoint(columns, count):
+            nonlocal checkpoint_num, flushed_count
+            checkpoint_num += 1
+            flush_batch(columns, count, writer, schema, checkpoint_num, checkpoint_folder, base_value, flushed_count + 1, clean_columns)
+            flushed_count += count
+
+        def handle_columns(result):
+            nonlocal processed_count, checkpoint_columns
+            for name, values in zip(COLUMN_NAMES, result):
+                checkpoint_columns[name].extend(values)
+            processed_count += len(result[0])
+            progress.update(len(result[0]))
+
+            while len(checkpoint_columns['Title']) >= checkpoint_interval:
+                head = {name: values[:checkpoint_interval] for name, values in checkpoint_columns.items()}
+                checkpoint_columns = {name: values[checkpoint_interval:] for name, values in checkpoint_columns.items()}
+                flush_checkpoint(head, checkpoint_interval)
+
+        pending = deque()
+        chunk = []
+        for line in file:
             if not extract_all and processed_count >= limit:
                 break
-            
-            entry = json.loads(line.strip())
-            
-            wiki = entry.get('wiki', None)
-            language = entry.get('language', None)
-            title = entry.get('title', None)
-            full_text = entry.get('full_text', None) if extract_option in ['full_text', 'both'] else None
-            abstract = entry.get('opening_text', None) if extract_option in ['abstract', 'both'] else None
-            popularity_score = entry.get('popularity_score', None)
-            
-            if all([wiki, language, title, (full_text if full_text else abstract)]):
-                formatted_title = format_title(title)
-                url = f"https://{language_code}.wikipedia.org/wiki/{formatted_title}" if formatted_title else None
-                
-                if clean_text_flag == 'yes':
-                    if full_text:
-                        full_text = clean_text(full_text)
-                    if abstract:
-                        abstract = clean_text(abstract)
-                
-                version_control_value = base_value + str(processed_count + 1)
-                version_control_bytes = version_control_value.encode('utf-8')
-                version_control_base64 = base64.b64encode(version_control_bytes).decode('utf-8')
-                
-                entry_data = {
-                    'URL': url,
-                    'Wiki': wiki,
-                    'Language': language,
-                    'Title': title,
-                    'Version Control': version_control_base64,
-                    'Popularity Score': popularity_score
-                }
-
-                if extract_option in ['abstract', 'both']:
-                    entry_data['Abstract'] = abstract
-                    data_abstract.append(entry_data)
-                    checkpoint_data_abstract.append(entry_data)
-                    
-                if extract_option in ['full_text', 'both']:
-                    entry_data['Full Text'] = full_text
-                    data_full_text.append(entry_data)
-                    checkpoint_data_full_text.append(entry_data)
-                
-                processed_count += 1
-                
-                if processed_count % checkpoint_interval == 0:
-                    checkpoint_num += 1
-                    if checkpoint_data_abstract:
-                        save_checkpoint(checkpoint_data_abstract, checkpoint_num, checkpoint_folder, 'Abstract')
-                        checkpoint_data_abstract = []
-                    if checkpoint_data_full_text:
-                        save_checkpoint(checkpoint_data_full_text, checkpoint_num, checkpoint_folder, 'Full Text')
-                        checkpoint_data_full_text = []
-                
-                print(f"Processed entry {processed_count}")
-
-    if checkpoint_data_abstract:
-        checkpoint_num += 1
-        save_checkpoint(checkpoint_data_abstract, checkpoint_num, checkpoint_folder, 'Abstract')
-
-    if checkpoint_data_full_text:
-        checkpoint_num += 1
-        save_checkpoint(checkpoint_data_full_text, checkpoint_num, checkpoint_folder, 'Full Text')
-
-    # Write data to separate Parquet files
-    if data_abstract:
-        table_abstract = pa.Table.from_pydict({
-            'URL': [d['URL'] for d in data_abstract],
-            'Wiki': [d['Wiki'] for d in data_abstract],
-            'Language': [d['Language'] for d in data_abstract],
-            'Title': [d['Title'] for d in data_abstract],
-            'Abstract': [d['Abstract'] for d in data_abstract],
-            'Version Control': [d['Version Control'] for d in data_abstract],
-            'Popularity Score': [d['Popularity Score'] for d in data_abstract]
-        })
-        pq.write_table(table_abstract, abstract_output_file)
-        print(f"Data with abstracts saved to {abstract_output_file}")
-
-    if data_full_text:
-        table_full_text = pa.Table.from_pydict({
-            'URL': [d['URL'] for d in data_full_text],
-            'Wiki': [d['Wiki'] for d in data_full_text],
-            'Language': [d['Language'] for d in data_full_text],
-            'Title': [d['Title'] for d in data_full_text],
-            'Full Text': [d['Full Text'] for d in data_full_text],
-            'Version Control': [d['Version Control'] for d in data_full_text],
-            'Popularity Score': [d['Popularity Score'] for d in data_full_text]
-        })
-        pq.write_table(table_full_text, full_text_output_file)
-        print(f"Data with full texts saved to {full_text_output_file}")
+
+            chunk.append(line)
+            if len(chunk) == LINES_PER_CHUNK:
+                pending.append(executor.submit(process_lines, chunk))
+                chunk = []
+                if len(pending) >= max_workers * 2:
+                    handle_columns(pending.popleft().result())
+
+        if chunk:
+            pending.append(executor.submit(process_lines, chunk))
+
+        while pending:
+            handle_columns(pending.popleft().result())
+
+        if checkpoint_columns['Title']:
+            flush_checkpoint(checkpoint_columns, len(checkpoint_columns['Title']))
+
+    progress.close()
+
+    writer.close()
+    print(f"Data saved to {output_file}")
 
     shutil.rmtree(checkpoint_folder, ignore_errors=True)
     print(f"Checkpoint folder '{checkpoint_folder}' deleted.")